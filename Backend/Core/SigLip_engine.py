@@ -1,15 +1,16 @@
 import os
 import glob
+import time
 import torch
 import torch.nn.functional as F
 from torch.utils.data import Dataset, DataLoader
 from transformers import SiglipVisionModel, SiglipProcessor
 from PIL import Image
-import faiss
 from tqdm import tqdm
 import numpy as np
 import shutil
-from Backend.Core.database import init_db, get_or_insert_video, get_max_vector_id, get_existing_filenames, get_vector_ids, delete_video_data, get_video_id_from_path
+from Backend.Core.index_store import load_index, publish_changes, remove_video_vectors
+from Backend.Core.database import init_db, get_or_insert_video, get_max_vector_id, get_existing_filenames, video_name_from_frame, update_vector_ranges
 from Backend.Core.config import *
 
 log = logging.getLogger(__name__)
@@ -93,21 +94,15 @@ def process_and_index(data_folder):
     dataloader = DataLoader(dataset, batch_size=BATCH_SIZE, num_workers=NUM_WORKERS, pin_memory=True, collate_fn=custom_collate_fn)
     
     
-    if os.path.exists("vector_storage.index"):
-        try:
-            index = faiss.read_index("vector_storage.index")
-        except:
-            log.warning("Could not read existing index, creating new IndexIDMap.")
-            sub_index = faiss.IndexFlatIP(768)
-            index = faiss.IndexIDMap(sub_index)
-    else:
-        sub_index = faiss.IndexFlatIP(768)
-        index = faiss.IndexIDMap(sub_index)
+    index, _ = load_index()
     
     log.info(f"Starting Embedding with SigLIP on {device}")
     
     current_max_id = get_max_vector_id(conn)
     start_id = current_max_id + 1
+    last_publish = time.perf_counter()
+    pending_vectors, pending_ids = [], []  # added since the last publish
+    video_ids = {}  # video name -> video_id, avoids a lookup per frame
 
     with torch.no_grad():
         for batch in tqdm(dataloader):
@@ -123,8 +118,11 @@ def process_and_index(data_folder):
             ids = np.arange(start_id, start_id + batch_size).astype('int64')
             
             index.add_with_ids(embeddings_np, ids)
+            pending_vectors.append(embeddings_np)
+            pending_ids.append(ids)
             
             cursor = conn.cursor()
+            batch_video_ids = set()
             for i, path in enumerate(paths):
                 filename = os.path.basename(path)
                 try:
@@ -138,59 +136,30 @@ def process_and_index(data_folder):
                     timestamp = pts * fps
                 except:
                     timestamp = 0.0
-                vid_row_id = get_or_insert_video(conn, path) 
+                video_name = video_name_from_frame(filename)
+                if video_name not in video_ids:
+                    video_ids[video_name] = get_or_insert_video(conn, video_name)
+                vid_row_id = video_ids[video_name]
+                batch_video_ids.add(vid_row_id)
                 
                 cursor.execute("""INSERT INTO frames (vector_id, video_id, timestamp, filename) 
                                   VALUES (?, ?, ?, ?)""", 
                                (int(ids[i]), vid_row_id, timestamp, filename))
             
+            update_vector_ranges(conn, batch_video_ids)
             conn.commit()
             start_id += batch_size
 
-    faiss.write_index(index, "vector_storage.index")
-    log.info("Indexing Complete.\n SQL Database Updated.")
-
-
-def remove_video_vectors(video_path):
-    """
-    Removes a video and its vectors. 
-    Problem: 'video_path' input in Add mode is the video file. 
-    But in DB 'videos' table, we are storing FRAME paths (based on previous analysis).
-    Wait, let's check get_or_insert_video usage in original code.
-    Original: video_id = get_or_insert_video(conn, path) where path is the image path.
-    This means 'videos' table actually stored image paths, which is wrong design for "Video" search.
-    However, to support "Remove Video", we face a challenge: We need to find all frames belonging to a video.
-    Frames are named "VideoName_fps=...".
-    So we can query by filename LIKE 'VideoName_%'.
-    """
-    conn = init_db()
-    video_basename = os.path.basename(video_path)
-    video_name_no_ext = os.path.splitext(video_basename)[0]
-    
-    cursor = conn.cursor()
-    query_pattern = f"{video_name_no_ext}_fps=%"
-    cursor.execute("SELECT vector_id, video_id, filename FROM frames WHERE filename LIKE ?", (query_pattern,))
-    rows = cursor.fetchall()
-    
-    if not rows:
-        log.warning(f"No frames found for video: {video_name_no_ext}")
-        return
+            # Metadata is committed before the vectors are published, so a searcher
+            # never gets a vector_id it cannot resolve.
+            if time.perf_counter() - last_publish >= PUBLISH_INTERVAL:
+                publish_changes(index, np.concatenate(pending_vectors), np.concatenate(pending_ids))
+                pending_vectors, pending_ids = [], []
+                last_publish = time.perf_counter()
 
-    vector_ids = [r[0] for r in rows]
-    video_ids = set(r[1] for r in rows)
-    
-    if os.path.exists("vector_storage.index"):
-        index = faiss.read_index("vector_storage.index")
-        ids_to_remove = np.array(vector_ids).astype('int64')
-        index.remove_ids(ids_to_remove)
-        faiss.write_index(index, "vector_storage.index")
-    
-    cursor.execute("DELETE FROM frames WHERE filename LIKE ?", (query_pattern,))
-    for vid in video_ids:
-        cursor.execute("DELETE FROM videos WHERE video_id = ?", (vid,))
-    
-    conn.commit()
-    log.info(f"Removed {len(vector_ids)} vectors for video: {video_name_no_ext}")
+    if pending_ids:
+        publish_changes(index, np.concatenate(pending_vectors), np.concatenate(pending_ids))
+    log.info("Indexing Complete.\n SQL Database Updated.")
 
 
 if __name__ == '__main__' :
@@ -18,7 +18,12 @@ VP_Thread = 2
 # @ SigLip_engine.py :
 
 DATA_FOLDER = "./Backend/Data"
-INDEX_FILE = "vector_storage.index"
+INDEX_FILE = "vector_storage.index"   # legacy single-file index, read only if no generation is published
+INDEX_DIR = "index_generations"       # versioned index snapshots + CURRENT pointer (see index_store.py)
+KEEP_GENERATIONS = 3                  # segments only older generations use are deleted on publish
+PUBLISH_INTERVAL = 10                 # seconds between publishes of newly indexed vectors (as delta segments)
+COMPACT_FRACTION = 0.25               # rewrite a full base once deltas exceed this fraction of it
+MAX_SEGMENTS = 16                     # the newest deltas are merged to keep a generation within this many segments
 METADATA_FILE = "metadata.json"
 
 MODEL_NAME = "google/siglip-base-patch16-224"
@@ -26,3 +31,22 @@ MODEL_NAME = "google/siglip-base-patch16-224"
 BATCH_SIZE = 32  
 NUM_WORKERS = 4  
 
+
+
+# @ search_pipeline.py :
+
+MOMENT_CANDIDATES = 50  # FAISS hits per requested moment, used to pick candidate videos
+MOMENT_WINDOW = 2       # smoothing half-width, in frames
+MOMENT_IOU = 0.5        # same-video moments overlapping more than this are suppressed
+MOMENT_RADIUS = 10.0    # seconds of frames fetched and scored on each side of a hit
+MOMENT_EXTENT = 0.5     # moments span the frames scoring above floor + this fraction of (peak - floor)
+
+NUM_SHARDS = 1          # > 1 : search fans out to this many shard worker processes (see shards.py)
+SHARD_ADDRESSES = []    # [(host, port), ...] of shard nodes to use instead of local workers
+
+RESULT_CACHE_SIZE = 256 # cached (query, k, time_threshold, generation) results, LRU evicted
+
+
+# @ app.py :
+
+STARTUP_TARGET = 0.5  # seconds from launch until the menu is shown (heavy imports are deferred per flow)
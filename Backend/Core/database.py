@@ -1,45 +1,162 @@
+import os
 import sqlite3
 
+SCHEMA_VERSION = 2
+
+# Source video name of a frame ("VideoName_fps=..._pts=....jpg"), mirrors video_name_from_frame()
+FRAME_VIDEO_NAME_SQL = "CASE WHEN instr(filename, '_fps=') > 0 THEN substr(filename, 1, instr(filename, '_fps=') - 1) ELSE filename END"
+
+VIDEOS_SCHEMA = '''(   video_id INTEGER PRIMARY KEY, 
+                        name TEXT UNIQUE NOT NULL, 
+                        path TEXT, duration REAL, fps REAL, 
+                        first_vector_id INTEGER, last_vector_id INTEGER
+                    )'''
+
+FRAMES_SCHEMA = '''(   vector_id INTEGER PRIMARY KEY, 
+                        video_id INTEGER, 
+                        timestamp REAL, filename TEXT,
+                        FOREIGN KEY (video_id) REFERENCES videos (video_id)
+                    )'''
+
+# idx_frames_video_time also serves lookups by video_id alone (v1 had a separate index for that)
+INDEXES = '''
+    DROP INDEX IF EXISTS idx_frames_video_id;
+    CREATE INDEX IF NOT EXISTS idx_frames_filename ON frames (filename);
+    CREATE INDEX IF NOT EXISTS idx_frames_video_time ON frames (video_id, timestamp);
+'''
+
 def init_db(db_path="video_search.db"):
     """
-    Initialize the database with the given path.
+    Initialize the database with the given path, migrating older schemas.
     
     Args:
         db_path (str, optional): Path to the database file. Defaults to "video_search.db".
     """
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
-    # Table for videos
-    cursor.execute('''CREATE TABLE IF NOT EXISTS videos 
-                     (video_id INTEGER PRIMARY KEY, path TEXT UNIQUE)''')
-    # Table for frames/vectors
-    cursor.execute(''' CREATE TABLE IF NOT EXISTS frames 
-                    (   vector_id INTEGER PRIMARY KEY, 
-                        video_id INTEGER, 
-                        timestamp REAL, filename TEXT,
-                        FOREIGN KEY (video_id) REFERENCES videos (video_id)
-                    )
-                   ''')
-    conn.commit()
+    # WAL lets searches read committed frames while the indexer is still writing.
+    cursor.execute("PRAGMA journal_mode=WAL")
+
+    if cursor.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return conn
+
+    video_cols = [row[1] for row in cursor.execute("PRAGMA table_info(videos)")]
+    if video_cols and 'name' not in video_cols:
+        migrate_v0(conn)
+        return conn
+
+    conn.executescript(f'''
+        BEGIN;
+        CREATE TABLE IF NOT EXISTS videos {VIDEOS_SCHEMA};
+        CREATE TABLE IF NOT EXISTS frames {FRAMES_SCHEMA};
+        {INDEXES}
+        PRAGMA user_version = {SCHEMA_VERSION};
+        COMMIT;
+    ''')
     return conn
 
-def get_or_insert_video(conn, video_path):
+def migrate_v0(conn):
     """
-    Get or insert a video into the database.
+    v0 stored one 'videos' row per FRAME image path and had no secondary indexes.
+    Rebuilds 'videos' with one row per source video (named after the frame filenames),
+    re-points frames at it, adds the indexes and fills the vector-id ranges.
+    Source path / duration / fps stay empty until the video is added again.
     
     Args:
         conn (sqlite3.Connection): Database connection.
-        video_path (str): Path to the video file.
+    """
+    conn.executescript(f'''
+        BEGIN;
+        CREATE TABLE videos_v1 {VIDEOS_SCHEMA};
+        INSERT INTO videos_v1 (name) SELECT DISTINCT {FRAME_VIDEO_NAME_SQL} FROM frames;
+        UPDATE frames SET video_id = (SELECT video_id FROM videos_v1 WHERE name = {FRAME_VIDEO_NAME_SQL});
+        DROP TABLE videos;
+        ALTER TABLE videos_v1 RENAME TO videos;
+        {INDEXES}
+        UPDATE videos SET 
+            first_vector_id = (SELECT MIN(vector_id) FROM frames WHERE frames.video_id = videos.video_id),
+            last_vector_id = (SELECT MAX(vector_id) FROM frames WHERE frames.video_id = videos.video_id);
+        PRAGMA user_version = {SCHEMA_VERSION};
+        COMMIT;
+    ''')
+
+def video_name_from_frame(filename):
+    """
+    Get the source video name from a frame filename.
+    
+    Args:
+        filename (str): Frame image basename ("VideoName_fps=..._pts=....jpg").
+    
+    Returns:
+        str: Video name (without extension).
+    """
+    return filename.split('_fps=')[0]
+
+def get_or_insert_video(conn, video_name):
+    """
+    Get or insert a source video into the database.
+    
+    Args:
+        conn (sqlite3.Connection): Database connection.
+        video_name (str): Video file name without extension.
     
     Returns:
         int: Video ID.
     """
     cursor = conn.cursor()
-    cursor.execute("INSERT OR IGNORE INTO videos (path) VALUES (?)", (video_path,))
-    conn.commit()
-    cursor.execute("SELECT video_id FROM videos WHERE path = ?", (video_path,))
+    cursor.execute("INSERT OR IGNORE INTO videos (name) VALUES (?)", (video_name,))
+    cursor.execute("SELECT video_id FROM videos WHERE name = ?", (video_name,))
     return cursor.fetchone()[0]
 
+def register_video(conn, video_path, duration=None, fps=None):
+    """
+    Record a source video file and its properties.
+    
+    Args:
+        conn (sqlite3.Connection): Database connection.
+        video_path (str): Path to the video file.
+        duration (float, optional): Duration in seconds.
+        fps (float, optional): Frame rate.
+    
+    Returns:
+        int: Video ID.
+    """
+    video_id = get_or_insert_video(conn, os.path.splitext(os.path.basename(video_path))[0])
+    conn.execute("UPDATE videos SET path = ?, duration = ?, fps = ? WHERE video_id = ?", 
+                 (video_path, duration, fps, video_id))
+    conn.commit()
+    return video_id
+
+def get_video_by_name(conn, video_name):
+    """
+    Get a source video by name.
+    
+    Args:
+        conn (sqlite3.Connection): Database connection.
+        video_name (str): Video file name without extension.
+    
+    Returns:
+        tuple: (video_id, first_vector_id, last_vector_id), or None.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT video_id, first_vector_id, last_vector_id FROM videos WHERE name = ?", (video_name,))
+    return cursor.fetchone()
+
+def update_vector_ranges(conn, video_ids):
+    """
+    Refresh first / last vector ID of the given videos.
+    
+    Args:
+        conn (sqlite3.Connection): Database connection.
+        video_ids (iterable): Video IDs whose frames changed.
+    """
+    cursor = conn.cursor()
+    for video_id in video_ids:
+        cursor.execute("""UPDATE videos SET 
+                              first_vector_id = (SELECT MIN(vector_id) FROM frames WHERE video_id = ?),
+                              last_vector_id = (SELECT MAX(vector_id) FROM frames WHERE video_id = ?)
+                          WHERE video_id = ?""", (video_id, video_id, video_id))
+
 def get_max_vector_id(conn):
     """
     Get the maximum vector ID from the database.
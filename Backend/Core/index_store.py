@@ -0,0 +1,468 @@
+import os
+import json
+import time
+import threading
+import faiss
+import numpy as np
+from Backend.Core.database import init_db, get_video_by_name, get_vector_ids, delete_video_data
+from Backend.Core.config import *
+
+log = logging.getLogger(__name__)
+
+
+# Index generations: the indexer never rewrites a file a searcher may be reading.
+# A generation is a manifest listing segment files : one full base segment followed by
+# append-only delta segments holding only the vectors added since. Each publish writes
+# its new segment + "manifest.<gen>.json", then swaps the CURRENT pointer with os.replace,
+# so readers always see a complete generation and only read the segments they lack.
+#
+# When search is sharded, every segment is written as one file per shard
+# ("vector_storage.<seg>.shard<i>of<n>.index", vector_id % n == i), so a shard worker
+# or node reads and holds only its own 1/n of the vectors.
+_publish_lock = threading.Lock()
+_REPLACE_RETRIES = 8  # os.replace attempts, 10 ms doubling, while a reader holds the target open (Windows)
+
+
+def shard_count():
+    """
+    Returns:
+        int: Number of search shards configured (SHARD_ADDRESSES wins over NUM_SHARDS).
+    """
+    return len(SHARD_ADDRESSES) or max(1, NUM_SHARDS)
+
+
+def _current_file(index_dir):
+    return os.path.join(index_dir, "CURRENT")
+
+
+def _segment_path(segment, shard=None, n_shards=1, index_dir=INDEX_DIR):
+    if shard is None or n_shards == 1:
+        return os.path.join(index_dir, f"vector_storage.{segment:08d}.index")
+    return os.path.join(index_dir, f"vector_storage.{segment:08d}.shard{shard}of{n_shards}.index")
+
+
+def _manifest_path(generation, index_dir=INDEX_DIR):
+    return os.path.join(index_dir, f"manifest.{generation:08d}.json")
+
+
+def _new_index():
+    sub_index = faiss.IndexFlatIP(768)
+    return faiss.IndexIDMap(sub_index)
+
+
+def _write_atomic(path, write):
+    tmp_path = path + ".tmp"
+    write(tmp_path)
+    for attempt in range(_REPLACE_RETRIES):
+        try:
+            os.replace(tmp_path, path)
+            return
+        except PermissionError:
+            # Windows refuses to replace a file another process has open (e.g. CURRENT,
+            # read by every query); readers hold it only briefly.
+            if attempt == _REPLACE_RETRIES - 1:
+                raise
+            time.sleep(0.01 * 2 ** attempt)
+
+
+def _vectors(index):
+    """
+    Zero-copy view of the vectors and ids of an IndexIDMap(IndexFlat).
+    """
+    flat = faiss.downcast_index(index.index)
+    vectors = faiss.rev_swig_ptr(flat.get_xb(), index.ntotal * index.d).reshape(index.ntotal, index.d)
+    return vectors, faiss.vector_to_array(index.id_map).astype('int64')
+
+
+def split_index(index, n_shards):
+    """
+    Split an IndexIDMap(IndexFlatIP) into shards by vector_id % n_shards.
+
+    Args:
+        index (faiss.IndexIDMap): Full index.
+        n_shards (int): Number of shards.
+
+    Returns:
+        list: n_shards faiss.IndexIDMap.
+    """
+    shards = [_new_index() for _ in range(n_shards)]
+    if index.ntotal:
+        vectors, ids = _vectors(index)
+        for shard, sub in enumerate(shards):
+            mask = ids % n_shards == shard
+            if mask.any():
+                sub.add_with_ids(np.ascontiguousarray(vectors[mask]), ids[mask])
+    return shards
+
+
+def current_generation(index_dir=INDEX_DIR):
+    """
+    Get the newest published index generation.
+
+    Returns:
+        int: Generation number, 0 if nothing has been published yet.
+    """
+    try:
+        with open(_current_file(index_dir)) as f:
+            return int(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def read_manifest(generation=None, index_dir=INDEX_DIR):
+    """
+    Read the manifest of a generation (default : the newest).
+
+    Returns:
+        dict: 'generation', 'segments' (base first, then deltas), their 'sizes' and
+              the number of 'shards' they are split in. Generation 0 (nothing published)
+              has no segments.
+    """
+    generation = current_generation(index_dir) if generation is None else generation
+    if generation == 0:
+        return {'generation': 0, 'segments': [], 'sizes': [], 'shards': 1}
+    with open(_manifest_path(generation, index_dir)) as f:
+        manifest = json.load(f)
+    manifest.setdefault('shards', 1)
+    return manifest
+
+
+def _read_segment(segment, manifest, shard, n_shards, index_dir):
+    """
+    Read one segment : the whole of it (shard=None) or one shard of it.
+    """
+    layout = manifest['shards']
+    if shard is None:
+        if layout == 1:
+            return faiss.read_index(_segment_path(segment, index_dir=index_dir))
+        return merge_segments([faiss.read_index(_segment_path(segment, i, layout, index_dir))
+                               for i in range(layout)])
+    if layout == n_shards:
+        return faiss.read_index(_segment_path(segment, shard, n_shards, index_dir))
+    if layout == 1:
+        # Published before sharding was enabled : split once, until the next full publish
+        log.warning(f"Segment {segment} is not sharded, reading the whole of it for shard {shard}")
+        return split_index(faiss.read_index(_segment_path(segment, index_dir=index_dir)), n_shards)[shard]
+    raise RuntimeError(f"Index generation {manifest['generation']} is split in {layout} shards, "
+                       f"not {n_shards}. Publish the index again with the current shard count.")
+
+
+def load_segments(loaded=None, shard=None, n_shards=1, index_dir=INDEX_DIR):
+    """
+    Reader side : load the segments of the newest generation, reusing the ones
+    already in memory, so a new delta costs only the delta's size to pick up.
+    Falls back to the legacy single INDEX_FILE (as segment 0) when nothing is published.
+    Raises if the generation can't be read; readers should keep serving what they have.
+
+    Args:
+        loaded (dict, optional): segment -> faiss index already loaded by the caller.
+        shard (int, optional): Load only this shard of every segment.
+        n_shards (int, optional): Shard count the caller serves.
+        index_dir (str, optional): Directory holding the generations.
+
+    Returns:
+        tuple: (manifest dict, dict segment -> faiss.IndexIDMap)
+    """
+    loaded = loaded or {}
+    for attempt in range(3):
+        try:
+            manifest = read_manifest(index_dir=index_dir)
+            if manifest['generation'] == 0:
+                if not os.path.exists(INDEX_FILE):
+                    return manifest, {}
+                if 0 not in loaded:
+                    legacy = faiss.read_index(INDEX_FILE)
+                    loaded = {0: legacy if shard is None else split_index(legacy, n_shards)[shard]}
+                return manifest, {0: loaded[0]}
+            return manifest, {seg: loaded[seg] if seg in loaded else _read_segment(seg, manifest, shard, n_shards, index_dir)
+                              for seg in manifest['segments']}
+        except Exception:
+            # Pruned between reading CURRENT and opening the files : re-read the pointer.
+            if attempt == 2:
+                raise
+
+
+def merge_segments(segments):
+    """
+    Fold segments (base first) into one IndexIDMap. The first segment is modified in place.
+
+    Args:
+        segments (list): faiss.IndexIDMap segments.
+
+    Returns:
+        faiss.IndexIDMap: Merged index.
+    """
+    if not segments:
+        return _new_index()
+    index = segments[0]
+    for delta in segments[1:]:
+        if delta.ntotal:
+            index.add_with_ids(*_vectors(delta))
+    return index
+
+
+def search_segments(segments, queries, k):
+    """
+    Search every segment and merge the per-segment top-k.
+
+    Args:
+        segments (list): faiss indexes.
+        queries (np.ndarray): float32 array of shape (n, d).
+        k (int): Number of neighbours.
+
+    Returns:
+        tuple: (distances, indices) shaped like faiss.Index.search output.
+    """
+    if not segments:
+        return np.full((len(queries), k), -np.inf, dtype='float32'), np.full((len(queries), k), -1, dtype='int64')
+    results = [seg.search(queries, k) for seg in segments]
+    return merge_topk([d for d, _ in results], [i for _, i in results], k)
+
+
+def score_ids(segments, query, ids):
+    """
+    Exact similarity of one query to the given vector ids, found in whichever segment holds them.
+    The vectors are looked up through each segment's id map (sorted, as vector ids are
+    appended in increasing order) and scored directly, without scanning the segment.
+    Ids not in any segment are left out.
+
+    Args:
+        segments (list): faiss.IndexIDMap(IndexFlat) segments.
+        query (np.ndarray): float32 array of shape (1, d).
+        ids (np.ndarray): int64 vector ids.
+
+    Returns:
+        tuple: (ids, scores) 1-D arrays.
+    """
+    ids = np.asarray(ids, dtype='int64')
+    found_ids, found_scores = [], []
+    for seg in segments:
+        if seg.ntotal == 0 or len(ids) == 0:
+            continue
+        vectors, seg_ids = _vectors(seg)
+        order = None if (seg_ids[1:] > seg_ids[:-1]).all() else np.argsort(seg_ids)
+        sorted_ids = seg_ids if order is None else seg_ids[order]
+        slot = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        hit = sorted_ids[slot] == ids
+        rows = np.ascontiguousarray(slot[hit] if order is None else order[slot[hit]], dtype='int64')
+        # Inner products by row number, without gathering the rows into a copy first
+        scores = np.empty(len(rows), dtype='float32')
+        query_row = np.ascontiguousarray(query[0], dtype='float32')
+        faiss.fvec_inner_products_by_idx(faiss.swig_ptr(scores), faiss.swig_ptr(query_row), faiss.swig_ptr(vectors),
+                                         faiss.swig_ptr(rows), seg.d, 1, len(rows))
+        found_ids.append(ids[hit])
+        found_scores.append(scores)
+    if not found_ids:
+        return np.empty(0, dtype='int64'), np.empty(0, dtype='float32')
+    return np.concatenate(found_ids), np.concatenate(found_scores)
+
+
+def merge_topk(distances, indices, k):
+    """
+    Merge several (distances, indices) search results into one top-k (inner product, higher is better).
+    """
+    distances = np.concatenate(distances, axis=1)
+    indices = np.concatenate(indices, axis=1)
+    top = np.argsort(-distances, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(distances, top, axis=1), np.take_along_axis(indices, top, axis=1)
+
+
+def load_index(index_dir=INDEX_DIR):
+    """
+    Writer side : load the newest generation merged into one index, or create an empty one.
+    Unlike readers, a writer must never fall back to an empty index over existing data :
+    publishing it would silently drop every vector sqlite still points at.
+
+    Returns:
+        tuple: (faiss.IndexIDMap, int generation)
+
+    Raises:
+        RuntimeError: The published generation (or legacy index file) can't be read.
+    """
+    try:
+        manifest, segments = load_segments(index_dir=index_dir)
+    except Exception as e:
+        raise RuntimeError(f"Could not read index generation {current_generation(index_dir)}; "
+                           f"refusing to write over it. Check '{index_dir}'.") from e
+    return merge_segments([segments[seg] for seg in sorted(segments)]), manifest['generation']
+
+
+def _write_segment(index, segment, n_shards, index_dir):
+    if n_shards == 1:
+        _write_atomic(_segment_path(segment, index_dir=index_dir), lambda path: faiss.write_index(index, path))
+        return
+    for shard, sub in enumerate(split_index(index, n_shards)):
+        _write_atomic(_segment_path(segment, shard, n_shards, index_dir), lambda path: faiss.write_index(sub, path))
+
+
+def _publish(manifest, index_dir):
+    """
+    Write the manifest, point CURRENT at it and prune what older generations used.
+    Caller holds _publish_lock.
+    """
+    generation = manifest['generation']
+
+    def _write_manifest(path):
+        with open(path, "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+    _write_atomic(_manifest_path(generation, index_dir), _write_manifest)
+
+    def _write_current(path):
+        with open(path, "w") as f:
+            f.write(str(generation))
+            f.flush()
+            os.fsync(f.fileno())
+    _write_atomic(_current_file(index_dir), _write_current)
+
+    # Keep everything the last KEEP_GENERATIONS manifests reference
+    keep_manifests = set(range(generation - KEEP_GENERATIONS + 1, generation + 1))
+    keep_segments = set()
+    for g in keep_manifests:
+        try:
+            keep_segments.update(read_manifest(g, index_dir)['segments'])
+        except (FileNotFoundError, ValueError):
+            pass
+    for name in os.listdir(index_dir):
+        parts = name.split('.')
+        if len(parts) < 3 or not parts[1].isdigit() or name.endswith('.tmp'):
+            continue
+        number = int(parts[1])
+        if (parts[0] == 'manifest' and number not in keep_manifests) or \
+           (parts[0] == 'vector_storage' and number not in keep_segments and number < generation):
+            try:
+                os.remove(os.path.join(index_dir, name))
+            except OSError:
+                # Still open by a reader on Windows : leave it for the next publish.
+                pass
+
+
+def publish_index(index, n_shards=None, index_dir=INDEX_DIR):
+    """
+    Publish the whole index as a new base segment (a full snapshot).
+    Used after removals and to compact accumulated deltas.
+
+    Writers are serialized within a process only; run one indexer / remover at a time.
+
+    Args:
+        index (faiss.Index): Index to persist.
+        n_shards (int, optional): Shard files to split it in. Defaults to shard_count().
+        index_dir (str, optional): Directory holding the generations.
+
+    Returns:
+        int: The published generation number.
+    """
+    n_shards = n_shards or shard_count()
+    with _publish_lock:
+        os.makedirs(index_dir, exist_ok=True)
+        generation = current_generation(index_dir) + 1
+        _write_segment(index, generation, n_shards, index_dir)
+        _publish({'generation': generation, 'segments': [generation], 'sizes': [int(index.ntotal)],
+                  'shards': n_shards}, index_dir)
+
+    log.debug(f"Published index generation {generation} : full snapshot ({index.ntotal} vectors, {n_shards} shards)")
+    return generation
+
+
+def publish_delta(vectors, ids, merge=0, index_dir=INDEX_DIR):
+    """
+    Publish only the given new vectors, as a delta segment on top of the current generation
+    (split in the same number of shards).
+
+    Args:
+        vectors (np.ndarray): float32 array of shape (n, 768).
+        ids (np.ndarray): int64 vector ids.
+        merge (int, optional): Number of newest deltas to fold into the new segment. Defaults to 0.
+        index_dir (str, optional): Directory holding the generations.
+
+    Returns:
+        int: The published generation number.
+    """
+    delta = _new_index()
+    delta.add_with_ids(vectors, ids)
+    with _publish_lock:
+        manifest = read_manifest(index_dir=index_dir)
+        generation = manifest['generation'] + 1
+        merge = min(merge, len(manifest['segments']) - 1)
+        keep = len(manifest['segments']) - merge
+        if merge > 0:
+            delta = merge_segments([_read_segment(seg, manifest, None, 1, index_dir)
+                                    for seg in manifest['segments'][keep:]] + [delta])
+        _write_segment(delta, generation, manifest['shards'], index_dir)
+        _publish({'generation': generation,
+                  'segments': manifest['segments'][:keep] + [generation],
+                  'sizes': manifest['sizes'][:keep] + [int(delta.ntotal)],
+                  'shards': manifest['shards']}, index_dir)
+
+    log.debug(f"Published index generation {generation} : delta of {len(ids)} vectors"
+              + (f", merged with {merge} older deltas" if merge else ""))
+    return generation
+
+
+def publish_changes(index, vectors, ids):
+    """
+    Indexer entry point : publish newly added vectors.
+    Writes a delta segment; deltas are merged size-tiered (the newest deltas are folded into
+    the new one while none is bigger than what is being written, or to stay within MAX_SEGMENTS),
+    so delta sizes roughly double down the list and a vector is rewritten O(log(deltas / batch))
+    times. The full index is written as a new base only once the deltas would grow past
+    COMPACT_FRACTION of the base (or the shard count changed) : O(1 / COMPACT_FRACTION) base
+    rewrites per vector ingested, whatever the corpus size and ingestion rate.
+
+    Args:
+        index (faiss.Index): The writer's full in-memory index (already holding the new vectors).
+        vectors (np.ndarray): The new vectors since the last publish.
+        ids (np.ndarray): Their vector ids.
+
+    Returns:
+        int: The published generation number.
+    """
+    manifest = read_manifest()
+    sizes = manifest['sizes']
+    if not sizes or manifest['shards'] != shard_count() \
+            or sum(sizes[1:]) + len(ids) > COMPACT_FRACTION * sizes[0]:
+        return publish_index(index)
+
+    merge, size = 0, len(ids)
+    while merge < len(sizes) - 1 and (sizes[-1 - merge] <= size or len(sizes) - merge >= MAX_SEGMENTS):
+        size += sizes[-1 - merge]
+        merge += 1
+    return publish_delta(vectors, ids, merge=merge)
+
+
+def remove_video_vectors(video_path):
+    """
+    Removes a video and its vectors.
+    The video is looked up by name in 'videos' (unique index) and its frames through
+    idx_frames_video_time, so the metadata side does not scan the frames table.
+    The index side still reads the merged index and publishes a full snapshot, so a
+    removal costs a full index rewrite; a video that has no indexed frames skips it.
+
+    Lives here rather than in SigLip_engine so removal does not pull in torch / transformers.
+    
+    Args:
+        video_path (str): Path (or file name) of the source video.
+    """
+    conn = init_db()
+    video_name_no_ext = os.path.splitext(os.path.basename(video_path))[0]
+
+    row = get_video_by_name(conn, video_name_no_ext)
+    if not row:
+        log.warning(f"No frames found for video: {video_name_no_ext}")
+        return
+    video_id = row[0]
+
+    vector_ids = get_vector_ids(conn, video_id)
+    if not vector_ids:
+        # Registered by bulk_extract_frames but never indexed : nothing to rewrite
+        delete_video_data(conn, video_id)
+        log.info(f"Removed video without indexed frames: {video_name_no_ext}")
+        return
+
+    index, _ = load_index()
+    index.remove_ids(np.array(vector_ids).astype('int64'))
+
+    delete_video_data(conn, video_id)
+    publish_index(index)
+    log.info(f"Removed {len(vector_ids)} vectors for video: {video_name_no_ext}")
@@ -1,13 +1,190 @@
 from transformers import SiglipTextModel, SiglipTokenizer
 import torch
 import sqlite3
-import faiss
+import time
+import atexit
+import threading
+from collections import OrderedDict
 import Backend.Core.config as config
+import Backend.Core.index_store as index_store
 import torch.nn.functional as F
+import numpy as np
 import logging
 
 log = logging.getLogger(__name__)
 
+# Text model, tokenizer and index segments are loaded once per process and reused by every query.
+_resources = {}
+_resources_lock = threading.Lock()
+_swap_thread = None
+_first_load_lock = threading.Lock()
+_shard_pool = None
+# Oldest index generation the current thread's searches were answered from (see cached_search)
+_served = threading.local()
+
+
+def _sharded():
+    return index_store.shard_count() > 1 or bool(config.SHARD_ADDRESSES)
+
+
+def _record_served(generation):
+    previous = getattr(_served, 'generation', None)
+    _served.generation = generation if previous is None else min(previous, generation)
+
+
+def get_shard_pool():
+    """
+    Start (once) the shard workers / connect to the shard nodes from config, and have
+    them load their shards right away, so warm-up covers the index too.
+
+    Returns:
+        ShardPool: Pool used by search_index.
+    """
+    global _shard_pool
+    from Backend.Core.shards import ShardPool
+    with _first_load_lock:
+        if _shard_pool is None:
+            pool = ShardPool(n_shards=config.NUM_SHARDS, addresses=config.SHARD_ADDRESSES or None)
+            try:
+                pool.warm_up(index_store.current_generation())
+            except Exception:
+                pool.close()
+                raise
+            atexit.register(pool.close)
+            _shard_pool = pool
+        return _shard_pool
+
+
+def _swap_in_latest_index():
+    with _resources_lock:
+        loaded = _resources.get('segments') or {}
+    try:
+        manifest, segments = index_store.load_segments(loaded)
+    except Exception as e:
+        # Reader fallback : keep serving what is already loaded
+        log.warning(f"Could not load index generation {index_store.current_generation()}: {e}")
+        with _resources_lock:
+            _resources.setdefault('segments', {})
+            _resources.setdefault('generation', -1)
+        return
+    with _resources_lock:
+        if manifest['generation'] > _resources.get('generation', -1) or 'segments' not in _resources:
+            _resources['segments'] = segments
+            _resources['generation'] = manifest['generation']
+    log.debug(f"Search now serving index generation {manifest['generation']} ({len(segments)} segments)")
+
+
+def refresh_index():
+    """
+    Pick up a newer published index generation without pausing queries:
+    the new generation is loaded on a background thread and swapped in,
+    while queries keep using the generation they already hold.
+    """
+    global _swap_thread
+    generation = index_store.current_generation()
+    with _resources_lock:
+        if generation <= _resources.get('generation', -1):
+            return
+        if _swap_thread is not None and _swap_thread.is_alive():
+            return
+        _swap_thread = threading.Thread(target=_swap_in_latest_index, name="index-swap", daemon=True)
+        _swap_thread.start()
+
+
+def load_search_resources():
+    """
+    Load (or return the already loaded) text model, tokenizer and FAISS index segments.
+    The first call loads the index synchronously (concurrent callers, e.g. the warm-up
+    thread and the first query, wait for that one load); later calls only trigger a
+    background swap when a newer generation has been published.
+
+    Returns:
+        dict: keys 'device', 'tokenizer', 'model', 'segments', 'generation'.
+    """
+    with _resources_lock:
+        if 'model' not in _resources:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            _resources['device'] = device
+            _resources['tokenizer'] = SiglipTokenizer.from_pretrained(config.MODEL_NAME)
+            _resources['model'] = SiglipTextModel.from_pretrained(config.MODEL_NAME).to(device).eval()
+
+    if _sharded():
+        # Shard workers hold the vectors; they swap generations themselves.
+        with _resources_lock:
+            _resources['segments'] = None
+            _resources['generation'] = index_store.current_generation()
+        get_shard_pool()
+    elif 'segments' not in _resources:
+        with _first_load_lock:
+            if 'segments' not in _resources:
+                _swap_in_latest_index()
+    else:
+        refresh_index()
+
+    with _resources_lock:
+        return dict(_resources)
+
+
+def encode_query(res, query_text):
+    """
+    Encode a text query into a normalized SigLIP vector.
+
+    Args:
+        res (dict): Resources returned by load_search_resources.
+        query_text (str): The text query.
+
+    Returns:
+        np.ndarray: float32 array of shape (1, 768).
+    """
+    inputs = res['tokenizer']([query_text], padding="max_length", 
+                              max_length=64, return_tensors="pt").to(res['device'])
+    
+    with torch.no_grad():
+        text_vec = res['model'](**inputs).pooler_output
+        return F.normalize(text_vec, p=2, dim=1).cpu().numpy().astype('float32')
+
+
+def search_index(res, text_vec, n):
+    """
+    Top-n FAISS search, on the in-process index or scattered over the shards
+    and merged, depending on config.NUM_SHARDS.
+
+    Args:
+        res (dict): Resources returned by load_search_resources.
+        text_vec (np.ndarray): Query vectors, shape (1, 768).
+        n (int): Number of neighbours.
+
+    Returns:
+        tuple: (distances, indices) as returned by faiss.Index.search.
+    """
+    if _sharded():
+        distances, indices, served = get_shard_pool().search(text_vec, n, generation=res['generation'])
+        _record_served(served)
+        return distances, indices
+    _record_served(res['generation'])
+    return index_store.search_segments(list(res['segments'].values()), text_vec, n)
+
+
+def score_index(res, text_vec, ids):
+    """
+    Exact similarity of the query to the given vector ids, in-process or on the shards.
+
+    Args:
+        res (dict): Resources returned by load_search_resources.
+        text_vec (np.ndarray): Query vector, shape (1, 768).
+        ids (np.ndarray): int64 vector ids.
+
+    Returns:
+        tuple: (ids, scores) 1-D arrays; ids missing from the index are left out.
+    """
+    if _sharded():
+        ids, scores, served = get_shard_pool().score_ids(text_vec, ids, generation=res['generation'])
+        _record_served(served)
+        return ids, scores
+    _record_served(res['generation'])
+    return index_store.score_ids(list(res['segments'].values()), text_vec, ids)
+
+
 def search_with_temporal_filter(query_text, k=5, time_threshold=5.0):
     """
     Perform a search with temporal filtering.
@@ -17,21 +194,14 @@ def search_with_temporal_filter(query_text, k=5, time_threshold=5.0):
         k (int, optional): Number of results to return. Defaults to 5.
         time_threshold (float, optional): Time threshold for temporal filtering. Defaults to 5.0.
     """
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    tokenizer = SiglipTokenizer.from_pretrained("google/siglip-base-patch16-224")
-    model = SiglipTextModel.from_pretrained("google/siglip-base-patch16-224").to(device)
-    index = faiss.read_index("vector_storage.index")
+    res = load_search_resources()
     conn = sqlite3.connect("video_search.db")
+    log.debug(f"Searching index generation {res['generation']}")
     
-    
-    inputs = tokenizer([query_text], padding="max_length", 
-                       max_length=64, return_tensors="pt").to(device)
-    
-    with torch.no_grad():
-        text_vec = model(**inputs).pooler_output
-        text_vec = F.normalize(text_vec, p=2, dim=1).cpu().numpy().astype('float32')
+    text_vec = encode_query(res, query_text)
+    t1 = time.perf_counter()
 
-    distances, indices = index.search(text_vec, k * 10)
+    distances, indices = search_index(res, text_vec, k * 10)
     
     filtered_results = []
     seen_videos = {} # video_id -> list of timestamps already picked
@@ -65,10 +235,268 @@ def search_with_temporal_filter(query_text, k=5, time_threshold=5.0):
         if len(filtered_results) >= k:
             break
 
+    log.debug(f"Frame search + fetch in {(time.perf_counter()-t1)*1000:.1f} ms")
     log.info(f"Top Result Cosine Similarity: {filtered_results[0]['score'] if filtered_results else 0}")
     return filtered_results
 
 
+def localize_moments(video_ids, timestamps, scores, k=5, time_threshold=5.0,
+                     window=config.MOMENT_WINDOW, iou_threshold=config.MOMENT_IOU,
+                     min_score=None, extent=config.MOMENT_EXTENT):
+    """
+    Turn per-frame scores into ranked time intervals.
+    Inputs are flat arrays (one entry per frame) sorted by (video_id, timestamp), so each
+    video is a contiguous time-ordered run. Scores are smoothed with a triangular kernel over
+    +-window frames, renormalized where a run edge cuts it (never crossing into another video).
+    Each local peak grows into an interval while the smoothed score stays above
+    floor + extent * (peak - floor), the floor being min_score (or the run's lowest score),
+    and the intervals are then non-max suppressed per video.
+    Peaks at or below min_score (smoothed and at the peak frame itself) are only used to
+    backfill when fewer than k stronger moments survive.
+
+    Args:
+        video_ids (np.ndarray): Video id of each frame.
+        timestamps (np.ndarray): Frame time in seconds.
+        scores (np.ndarray): Frame similarity to the query.
+        k (int, optional): Number of moments to return. Defaults to 5.
+        time_threshold (float, optional): Peaks of the same video closer than this are suppressed. Defaults to 5.0.
+        window (int, optional): Smoothing half-width in frames.
+        iou_threshold (float, optional): Same-video moments overlapping more than this are suppressed.
+        min_score (float, optional): Score floor : weakest score still counted as relevant.
+        extent (float, optional): Fraction of the way from floor to peak an interval must stay above.
+
+    Returns:
+        list: (video_id, start, end, peak_index, score) tuples, best first.
+    """
+    n = len(scores)
+    if n == 0:
+        return []
+    video_ids = np.asarray(video_ids)
+    timestamps = np.asarray(timestamps, dtype='float64')
+    scores = np.asarray(scores, dtype='float64')
+
+    # First / last frame index of the video each frame belongs to
+    pos = np.arange(n)
+    new_run = np.r_[True, video_ids[1:] != video_ids[:-1]]
+    run_start = np.maximum.accumulate(np.where(new_run, pos, 0))
+    end_run = np.r_[video_ids[1:] != video_ids[:-1], True]
+    run_end = np.minimum.accumulate(np.where(end_run, pos, n - 1)[::-1])[::-1]
+
+    # Triangular kernel (weight window+1-|offset|) via prefix sums, clipped to the video and
+    # divided by the weight actually inside it, so edge frames are not biased.
+    lo = np.maximum(pos - window, run_start)
+    hi = np.minimum(pos + window, run_end)
+
+    def _weighted(values):
+        c, cj = np.r_[0.0, np.cumsum(values)], np.r_[0.0, np.cumsum(pos * values)]
+        left = (window + 1 - pos) * (c[pos + 1] - c[lo]) + (cj[pos + 1] - cj[lo])
+        right = (window + 1 + pos) * (c[hi + 1] - c[pos + 1]) - (cj[hi + 1] - cj[pos + 1])
+        return left + right
+    smoothed = _weighted(scores) / _weighted(np.ones(n))
+
+    # Local maxima inside each video
+    left = np.where(pos > run_start, np.roll(smoothed, 1), -np.inf)
+    right = np.where(pos < run_end, np.roll(smoothed, -1), -np.inf)
+    peaks = np.flatnonzero((smoothed >= left) & (smoothed >= right))
+
+    # Grow every peak outward one frame per step, while the next frame stays in the video
+    # and above the peak's threshold; stops as soon as no interval can grow.
+    if min_score is not None:
+        floor = np.full(n, float(min_score))
+    else:
+        floor = np.minimum.reduceat(smoothed, np.flatnonzero(new_run))[np.cumsum(new_run) - 1]
+    threshold = floor[peaks] + extent * (smoothed[peaks] - floor[peaks])
+    first, last = peaks.copy(), peaks.copy()
+    for bound, edge, step in ((first, run_start[peaks], -1), (last, run_end[peaks], 1)):
+        growing = bound != edge
+        while growing.any():
+            nxt = bound[growing] + step
+            ok = smoothed[nxt] >= threshold[growing]
+            bound[np.flatnonzero(growing)[ok]] = nxt[ok]
+            growing[growing] = ok
+            growing &= bound != edge
+
+    # Strong peaks by smoothed score, then the weak ones as backfill
+    weak = np.zeros(len(peaks), dtype=bool)
+    if min_score is not None:
+        weak = (smoothed[peaks] <= min_score) & (scores[peaks] <= min_score)
+    order = np.lexsort((-smoothed[peaks], weak))
+    peaks, first, last = peaks[order], first[order], last[order]
+    p_vid = video_ids[peaks]
+    p_start, p_end = timestamps[first], timestamps[last]
+    p_time = timestamps[peaks]
+
+    alive = np.ones(len(peaks), dtype=bool)
+    moments = []
+    for i in range(len(peaks)):
+        if not alive[i]:
+            continue
+        moments.append((p_vid[i].item(), float(p_start[i]), float(p_end[i]), int(peaks[i]), float(smoothed[peaks[i]])))
+        if len(moments) >= k:
+            break
+
+        inter = np.clip(np.minimum(p_end, p_end[i]) - np.maximum(p_start, p_start[i]), 0, None)
+        union = np.maximum(p_end, p_end[i]) - np.minimum(p_start, p_start[i])
+        iou = np.where(union > 0, inter / np.where(union > 0, union, 1), 1.0)
+        alive &= ~((p_vid == p_vid[i]) & ((iou > iou_threshold) | (np.abs(p_time - p_time[i]) < time_threshold)))
+
+    return moments
+
+
+def search_moments(query_text, k=5, time_threshold=5.0, radius=config.MOMENT_RADIUS):
+    """
+    Moment retrieval : rank time intervals instead of isolated frames.
+    Only the frames within +-radius seconds of the top FAISS hits are fetched (overlapping
+    windows of a video are merged) in one SQL statement, scored exactly against the query and
+    handed to localize_moments, with the weakest hit's score as the relevance floor.
+
+    Args:
+        query_text (str): The text query to search for.
+        k (int, optional): Number of moments to return. Defaults to 5.
+        time_threshold (float, optional): Minimum gap between peaks of the same video. Defaults to 5.0.
+        radius (float, optional): Seconds fetched on each side of a hit. Defaults to config.MOMENT_RADIUS.
+
+    Returns:
+        list: dicts with 'start', 'end', 'score', 'timestamp' (peak) and 'filename' (peak frame).
+    """
+    res = load_search_resources()
+    conn = sqlite3.connect("video_search.db")
+    
+    text_vec = encode_query(res, query_text)
+    t1 = time.perf_counter()
+    distances, indices = search_index(res, text_vec, k * config.MOMENT_CANDIDATES)
+
+    valid = indices[0] >= 0
+    hit_ids, hit_scores = indices[0][valid], distances[0][valid]
+    if len(hit_ids) == 0:
+        return []
+
+    cursor = conn.cursor()
+    marks = ",".join("?" * len(hit_ids))
+    cursor.execute(f"SELECT video_id, timestamp FROM frames WHERE vector_id IN ({marks}) ORDER BY video_id, timestamp", 
+                   [int(v) for v in hit_ids])
+    hits = np.array(cursor.fetchall(), dtype='float64').reshape(-1, 2)
+    if len(hits) == 0:
+        return []
+
+    # +-radius windows around the hits (time-ordered per video), merged when they overlap or are closer than time_threshold
+    hit_vid, lo, hi = hits[:, 0], hits[:, 1] - radius, hits[:, 1] + radius
+    new_range = np.r_[True, (hit_vid[1:] != hit_vid[:-1]) | (lo[1:] - hi[:-1] >= time_threshold)]
+    starts = np.flatnonzero(new_range)
+    ends = np.r_[starts[1:], len(hits)] - 1
+    windows = [(run, int(vid), float(t_lo), float(t_hi)) for run, (vid, t_lo, t_hi) 
+               in enumerate(zip(hit_vid[starts], lo[starts], hi[ends]))]
+
+    # All windows in one statement : each is a range scan on idx_frames_video_time
+    marks = ",".join(["(?,?,?,?)"] * len(windows))
+    cursor.execute(f"""WITH windows (run, video_id, lo, hi) AS (VALUES {marks})
+                       SELECT w.run, f.timestamp, f.vector_id 
+                       FROM windows w JOIN frames f ON f.video_id = w.video_id AND f.timestamp BETWEEN w.lo AND w.hi""", 
+                   [v for window in windows for v in window])
+    rows = np.array(cursor.fetchall(), dtype='float64').reshape(-1, 3)
+    rows = rows[np.lexsort((rows[:, 1], rows[:, 0]))]  # (window, time) order; cheaper than ORDER BY's temp b-tree
+    t_fetch = time.perf_counter()
+
+    run_ids = rows[:, 0].astype('int64')
+    timestamps = rows[:, 1]
+    vector_ids = rows[:, 2].astype('int64')
+
+    # Exact similarity of every fetched frame, laid onto the time-ordered arrays
+    # (frames missing from the index, e.g. not yet published, stay at the floor)
+    floor = float(hit_scores.min())
+    scores = np.full(len(vector_ids), floor)
+    scored_ids, scored = score_index(res, text_vec, vector_ids)
+    if len(scored_ids):
+        order = np.argsort(scored_ids)
+        scored_ids, scored = scored_ids[order], scored[order]
+        slot = np.clip(np.searchsorted(scored_ids, vector_ids), 0, len(scored_ids) - 1)
+        found = scored_ids[slot] == vector_ids
+        scores[found] = scored[slot[found]]
+
+    # Runs (one per merged window) keep smoothing and peaks from crossing gaps between windows
+    moments = localize_moments(run_ids, timestamps, scores, k=k, time_threshold=time_threshold, min_score=floor)
+    log.debug(f"Moments : {len(hit_ids)} hits, {len(rows)} frames in {len(windows)} windows, "
+              f"search + fetch {(t_fetch-t1)*1000:.1f} ms, total {(time.perf_counter()-t1)*1000:.1f} ms")
+
+    # Filenames only for the peak frames returned
+    peak_ids = [int(vector_ids[peak]) for _, _, _, peak, _ in moments]
+    cursor.execute(f"SELECT vector_id, filename FROM frames WHERE vector_id IN ({','.join('?' * len(peak_ids))})", peak_ids)
+    filenames = dict(cursor.fetchall())
+
+    results = [{
+        "score": score,
+        "start": start,
+        "end": end,
+        "timestamp": float(timestamps[peak]),
+        "filename": filenames[int(vector_ids[peak])]
+    } for _, start, end, peak, score in moments]
+
+    log.info(f"Top Moment Score: {results[0]['score'] if results else 0}")
+    return results
+
+
+# Result cache : (mode, normalized query, k, time_threshold, index generation) -> results.
+# A publish by process_and_index / remove_video_vectors bumps the generation, so
+# stale entries are never hit again and are dropped on the next insert.
+_result_cache = OrderedDict()
+_cache_stats = {'hits': 0, 'misses': 0}
+_cache_lock = threading.Lock()
+
+
+def cached_search(query_text, k=5, time_threshold=5.0, moments=False):
+    """
+    search_with_temporal_filter / search_moments behind a bounded LRU cache.
+    Results are cached only when every index lookup of the search was answered from the
+    generation current when the query came in.
+    
+    Args:
+        query_text (str): The text query to search for.
+        k (int, optional): Number of results to return. Defaults to 5.
+        time_threshold (float, optional): Time threshold for temporal filtering. Defaults to 5.0.
+        moments (bool, optional): Use search_moments instead of frame search. Defaults to False.
+    
+    Returns:
+        list: Copy of the search results.
+    """
+    generation = index_store.current_generation()
+    key = ('moments' if moments else 'frames', " ".join(query_text.lower().split()), k, time_threshold, generation)
+
+    with _cache_lock:
+        if key in _result_cache:
+            _result_cache.move_to_end(key)
+            _cache_stats['hits'] += 1
+            return [dict(r) for r in _result_cache[key]]
+        _cache_stats['misses'] += 1
+
+    _served.generation = None
+    search = search_moments if moments else search_with_temporal_filter
+    results = search(query_text, k=k, time_threshold=time_threshold)
+
+    if _served.generation == generation:
+        with _cache_lock:
+            for old in [old for old in _result_cache if old[-1] != generation]:
+                del _result_cache[old]
+            _result_cache[key] = [dict(r) for r in results]
+            while len(_result_cache) > config.RESULT_CACHE_SIZE:
+                _result_cache.popitem(last=False)
+    return results
+
+
+def cache_info():
+    """
+    Returns:
+        dict: hits, misses, current size and maxsize of the result cache.
+    """
+    with _cache_lock:
+        return {**_cache_stats, 'size': len(_result_cache), 'maxsize': config.RESULT_CACHE_SIZE}
+
+
+def cache_clear():
+    with _cache_lock:
+        _result_cache.clear()
+        _cache_stats['hits'] = _cache_stats['misses'] = 0
+
+
 if __name__ == '__main__' :
     while True :
         c = input("Search for :")
@@ -0,0 +1,292 @@
+import os
+import sys
+import time
+import threading
+import multiprocessing as mp
+from multiprocessing.connection import Listener, Client
+import faiss
+import numpy as np
+import Backend.Core.index_store as index_store
+from Backend.Core.config import *
+
+log = logging.getLogger(__name__)
+
+# Vector ids are split across shards by vector_id % n_shards, so every shard
+# gets an even share of every video and no shard map has to be stored.
+# index_store.publish_index writes one file per shard; each worker / node reads only its own.
+
+
+def _shard_state():
+    """
+    Segments a shard serves. Owned by the node (serve_shard) or the worker process,
+    so they outlive any one connection.
+    """
+    return {'segments': None, 'generation': -1, 'lock': threading.Lock(), 'loader': None}
+
+
+def _serve(conn, shard, n_shards, index_dir=INDEX_DIR, state=None):
+    """
+    Worker loop, until ('stop',) or the connection closes :
+        ('load', generation)             -> load this shard now, reply the generation served
+        ('search', generation, queries, k) -> (distances, indices, generation served)
+        ('score', generation, query, ids)  -> (ids, scores, generation served) for the ids on this shard
+    A newer generation requested by a search is loaded on a background thread while
+    queries keep hitting the segments already loaded; only the new segments are read.
+    """
+    # Shards share the machine : split the FAISS threads between them
+    faiss.omp_set_num_threads(max(1, (os.cpu_count() or 1) // n_shards))
+    state = state or _shard_state()
+    lock = state['lock']
+
+    def _load():
+        with lock:
+            loaded = state['segments']
+        manifest, segments = index_store.load_segments(loaded, shard, n_shards, index_dir)
+        with lock:
+            if manifest['generation'] > state['generation'] or state['segments'] is None:
+                state['segments'], state['generation'] = segments, manifest['generation']
+
+    def _load_in_background():
+        try:
+            _load()
+        except Exception as e:
+            # Reader fallback : keep serving the segments already loaded
+            log.warning(f"Shard {shard}: could not load new generation: {e}")
+
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            break
+        if msg[0] == 'stop':
+            break
+
+        try:
+            generation = msg[1]
+            if state['segments'] is None or (msg[0] == 'load' and generation > state['generation']):
+                _load()
+            elif generation > state['generation'] and not (state['loader'] and state['loader'].is_alive()):
+                state['loader'] = threading.Thread(target=_load_in_background, daemon=True)
+                state['loader'].start()
+            with lock:
+                segments, served = list(state['segments'].values()), state['generation']
+
+            if msg[0] == 'load':
+                conn.send(served)
+            elif msg[0] == 'score':
+                _, _, query, ids = msg
+                conn.send((*index_store.score_ids(segments, query, ids[ids % n_shards == shard]), served))
+            else:
+                _, _, queries, k = msg
+                conn.send((*index_store.search_segments(segments, queries, k), served))
+        except Exception as e:
+            conn.send(e)
+    conn.close()
+
+
+def serve_shard(address, shard, n_shards, index_dir=INDEX_DIR, authkey=b'svs-shard'):
+    """
+    Run a shard as a stand-alone node listening on a socket, e.g. on another machine
+    or in another terminal. ShardPool(addresses=[...]) connects to such nodes.
+    The node needs only the manifests and its own "*.shard<i>of<n>.index" files in index_dir.
+    Loaded segments are kept across connections, so a client that reconnects is served
+    from memory instead of waiting for the shard to be read again.
+
+    Args:
+        address (tuple): (host, port) to listen on.
+        shard (int): Shard number.
+        n_shards (int): Total number of shards.
+        index_dir (str, optional): Directory holding the generations.
+        authkey (bytes, optional): Shared secret for the connection.
+    """
+    state = _shard_state()
+    with Listener(address, authkey=authkey) as listener:
+        log.info(f"Shard {shard}/{n_shards} listening on {address}")
+        while True:
+            conn = listener.accept()
+            _serve(conn, shard, n_shards, index_dir, state)
+
+
+class ShardPool:
+    """
+    Scatter-gather search over N index shards.
+    By default each shard is served by a local worker process; pass addresses
+    to use shard nodes started with serve_shard instead.
+    A shard whose worker died (or whose node dropped the connection) is restarted /
+    reconnected and asked again once; if that fails too, a RuntimeError names it.
+
+    Args:
+        n_shards (int, optional): Number of local worker processes. Defaults to index_store.shard_count().
+        addresses (list, optional): (host, port) of running shard nodes, one per shard.
+        index_dir (str, optional): Directory holding the generations (local workers only).
+        authkey (bytes, optional): Shared secret for socket nodes.
+    """
+    def __init__(self, n_shards=None, addresses=None, index_dir=INDEX_DIR, authkey=b'svs-shard'):
+        self.addresses = [tuple(addr) for addr in addresses] if addresses else None
+        self.n_shards = len(self.addresses) if self.addresses else (n_shards or index_store.shard_count())
+        self.index_dir = index_dir
+        self.authkey = authkey
+        self.conns = [None] * self.n_shards
+        self.processes = [None] * self.n_shards
+        for shard in range(self.n_shards):
+            self._start(shard)
+        self.lock = threading.Lock()
+
+    def _start(self, shard):
+        if self.addresses:
+            self.conns[shard] = Client(self.addresses[shard], authkey=self.authkey)
+            return
+        # spawn, not fork : the pool is created from a thread of a process that already runs
+        # torch, and forking a multi-threaded process can deadlock the child
+        ctx = mp.get_context('spawn')
+        parent, child = ctx.Pipe()
+        p = ctx.Process(target=_serve, args=(child, shard, self.n_shards, self.index_dir), daemon=True)
+        p.start()
+        child.close()
+        self.conns[shard], self.processes[shard] = parent, p
+
+    def _restart(self, shard):
+        log.warning(f"Shard {shard} is down, {'reconnecting' if self.addresses else 'restarting its worker'}")
+        try:
+            self.conns[shard].close()
+        except OSError:
+            pass
+        p = self.processes[shard]
+        if p is not None and p.is_alive():
+            p.terminate()
+        self._start(shard)
+
+    def _request(self, msg):
+        """
+        Send msg to every shard at once and collect the replies, in shard order.
+        """
+        with self.lock:
+            sent = []
+            for shard, conn in enumerate(self.conns):
+                try:
+                    conn.send(msg)
+                    sent.append(shard)
+                except OSError:
+                    pass
+            replies = {}
+            for shard in sent:
+                try:
+                    replies[shard] = self.conns[shard].recv()
+                except (EOFError, OSError):
+                    pass
+
+            for shard in range(self.n_shards):
+                if shard in replies:
+                    continue
+                try:
+                    self._restart(shard)
+                    self.conns[shard].send(msg)
+                    replies[shard] = self.conns[shard].recv()
+                except (EOFError, OSError) as e:
+                    raise RuntimeError(f"Shard {shard} is unavailable") from e
+
+        replies = [replies[shard] for shard in range(self.n_shards)]
+        for reply in replies:
+            if isinstance(reply, Exception):
+                raise reply
+        return replies
+
+    def warm_up(self, generation=0):
+        """
+        Make every shard load its part of the index now, instead of on the first query.
+
+        Returns:
+            int: Oldest generation now served by the shards.
+        """
+        t1 = time.perf_counter()
+        served = min(self._request(('load', generation)))
+        log.debug(f"{self.n_shards} shards loaded generation {served} in {time.perf_counter()-t1:.2f}s")
+        return served
+
+    def search(self, queries, k, generation=0):
+        """
+        Fan the queries out to every shard and merge the per-shard top-k.
+
+        Args:
+            queries (np.ndarray): float32 array of shape (n, d).
+            k (int): Number of neighbours to return per query.
+            generation (int, optional): Index generation the caller expects; shards reload if behind.
+
+        Returns:
+            tuple: (distances, indices, generation) : distances / indices shaped like faiss.Index.search
+                output, and the oldest generation any shard answered from.
+        """
+        t1 = time.perf_counter()
+        replies = self._request(('search', generation, queries, k))
+
+        distances, indices = index_store.merge_topk([d for d, _, _ in replies], [i for _, i, _ in replies], k)
+        log.debug(f"Shard search over {self.n_shards} shards in {(time.perf_counter()-t1)*1000:.2f} ms")
+        return distances, indices, min(g for _, _, g in replies)
+
+    def score_ids(self, query, ids, generation=0):
+        """
+        Exact similarity of one query to the given vector ids, gathered from every shard.
+
+        Args:
+            query (np.ndarray): float32 array of shape (1, d).
+            ids (np.ndarray): int64 vector ids.
+            generation (int, optional): Index generation the caller expects.
+
+        Returns:
+            tuple: (ids, scores, generation) : 1-D arrays and the oldest generation any shard answered from.
+        """
+        replies = self._request(('score', generation, query, np.asarray(ids, dtype='int64')))
+        return (np.concatenate([i for i, _, _ in replies]), np.concatenate([s for _, s, _ in replies]),
+                min(g for _, _, g in replies))
+
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.send(('stop',))
+                conn.close()
+            except OSError:
+                pass
+        for p in self.processes:
+            if p is not None:
+                p.join(timeout=5)
+
+
+def benchmark(n_vectors=50_000, shard_counts=(1, 2, 4, 8), k=50, n_queries=100):
+    """
+    Latency of one query (768-d, flat IP) as the shard count grows, on random vectors.
+    """
+    import shutil
+    import tempfile
+    log.setLevel(logging.INFO)  # no per-query debug lines
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((n_vectors, 768)).astype('float32')
+    faiss.normalize_L2(vectors)
+    index = faiss.IndexIDMap(faiss.IndexFlatIP(768))
+    index.add_with_ids(vectors, np.arange(n_vectors).astype('int64'))
+    queries = vectors[rng.integers(0, n_vectors, n_queries)]
+
+    t1 = time.perf_counter()
+    for q in queries:
+        index.search(q[None], k)
+    print(f"in-process : {(time.perf_counter()-t1)/n_queries*1000:.2f} ms/query")
+
+    for n in shard_counts:
+        index_dir = tempfile.mkdtemp()
+        index_store.publish_index(index, n_shards=n, index_dir=index_dir)
+        pool = ShardPool(n_shards=n, index_dir=index_dir)
+        pool.warm_up(1)
+        t1 = time.perf_counter()
+        for q in queries:
+            pool.search(q[None], k, generation=1)
+        print(f"{n} shard(s) : {(time.perf_counter()-t1)/n_queries*1000:.2f} ms/query")
+        pool.close()
+        shutil.rmtree(index_dir)
+
+
+if __name__ == "__main__":
+    # python -m Backend.Core.shards                    -> latency benchmark
+    # python -m Backend.Core.shards serve PORT SHARD N -> run a shard node
+    if len(sys.argv) == 5 and sys.argv[1] == 'serve':
+        serve_shard(('localhost', int(sys.argv[2])), int(sys.argv[3]), int(sys.argv[4]))
+    else:
+        benchmark()
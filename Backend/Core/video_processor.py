@@ -4,6 +4,7 @@ import os
 import glob
 from concurrent.futures import ThreadPoolExecutor
 import time
+from Backend.Core.database import init_db, register_video
 from Backend.Core.config import *
 
 log = logging.getLogger(__name__)
@@ -116,6 +117,37 @@ def extract_frames(video_path, output_root, method='fast', use_gpu=True):
         return str(e)
 
 
+def probe_video(video_path):
+    """
+    Reads duration (seconds) and frame rate of a video with ffprobe.
+    Returns (None, None) for whatever could not be read.
+
+        :param video_path: path to input video file
+    """
+    try:
+        out = subprocess.check_output([
+                    'ffprobe', '-v', '0', '-select_streams', 'v:0',
+                    '-show_entries', 'stream=r_frame_rate:format=duration',
+                    '-of', 'default=noprint_wrappers=1',
+                    video_path
+                    ]).decode('utf-8')
+    except Exception as e:
+        log.warning(f"ffprobe failed for {video_path}: {e}")
+        return None, None
+
+    info = dict(line.split('=', 1) for line in out.strip().splitlines() if '=' in line)
+    try:
+        duration = float(info['duration'])
+    except (KeyError, ValueError):
+        duration = None
+    try:
+        num, den = map(int, info['r_frame_rate'].split('/'))
+        fps = num / den
+    except (KeyError, ValueError, ZeroDivisionError):
+        fps = None
+    return duration, fps
+
+
 def get_hw_accel_args():
     """
     Detects the GPU vendor and returns the corresponding FFmpeg hardware 
@@ -244,6 +276,12 @@ def bulk_extract_frames(input_folder=None, output_folder=None, use_gpu=True, thr
         if not result is True :
             log.error(result)
             return False
+
+    # Record the source videos (path, duration, fps) their frames will be linked to
+    conn = init_db()
+    for video_path in video_files:
+        register_video(conn, os.path.abspath(video_path), *probe_video(video_path))
+    conn.close()
     
     return True
 
@@ -1,29 +1,57 @@
 import time
+t_launch = time.perf_counter()
+
 import os
-from tkinter import filedialog
+import threading
 from Backend.Core.video_processor import bulk_extract_frames
-from Backend.Core.SigLip_engine import process_and_index, remove_video_vectors
-from Backend.Core.search_pipeline import search_with_temporal_filter 
 from Backend.Core.config import *
 
 log = logging.getLogger(__name__)
 
+# torch / transformers / faiss / tkinter are imported inside the flow that needs them,
+# so the menu does not wait on them.
+
 
-def run_search(query):
+def warm_up_search():
+    """
+    Import the search pipeline and load the text model + index on a background thread,
+    while the user is still typing the query.
+    """
+    def _load():
+        t1 = time.perf_counter()
+        try:
+            from Backend.Core.search_pipeline import load_search_resources
+            load_search_resources()
+            log.debug(f"Search warm-up done in {time.perf_counter()-t1:.2f}s")
+        except Exception as e:
+            log.error(f"Search warm-up failed: {e}")
+
+    threading.Thread(target=_load, name="search-warm-up", daemon=True).start()
+
+
+def run_search(query, moments=False):
     """
     Step 3: Perform search.
+    moments=True returns ranked time intervals instead of single frames.
     """
+    from Backend.Core.search_pipeline import cached_search, cache_info
+
     log.info(f"Searching for: '{query}'")
     t1 = time.perf_counter()
-    results = search_with_temporal_filter(query, k=5)
+    results = cached_search(query, k=5, moments=moments)
     t2 = time.perf_counter()
     log.debug(f"Time for succesfull Search = {t2-t1}\n")
+    log.debug(f"Result cache : {cache_info()}")
     print(f"\n--- Search Results --- (for {query=})")
     for idx, res in enumerate(results):
-        print(f"{idx+1}. Time: {res['timestamp']}s | Score: {res['score']:.4f} | File: {res['filename']}")
+        if moments:
+            print(f"{idx+1}. Moment: {res['start']}s - {res['end']}s | Peak: {res['timestamp']}s | Score: {res['score']:.4f} | File: {res['filename']}")
+        else:
+            print(f"{idx+1}. Time: {res['timestamp']}s | Score: {res['score']:.4f} | File: {res['filename']}")
     print("----------------------\n")
 
 def add_videos_flow():
+    from tkinter import filedialog
     
     choice = input("Select Source - Do you want to add a whole FOLDER? (y/n)\n : ")
     
@@ -70,11 +98,15 @@ def add_videos_flow():
         return
 
     print("Indexing...")
+    from Backend.Core.SigLip_engine import process_and_index
     process_and_index(DATA_FOLDER)
     return
     
 
 def remove_videos_flow():
+    from tkinter import filedialog
+    from Backend.Core.index_store import remove_video_vectors
+
     files = filedialog.askopenfilenames(title="Select Videos to Remove", filetypes=[("MP4 Videos", "*.mp4")])
     if not files: 
         return
@@ -87,17 +119,23 @@ def remove_videos_flow():
 
 def main():
     print("AI Video Search Engine Started.")
+    t_menu = time.perf_counter() - t_launch
+    if t_menu > STARTUP_TARGET:
+        log.warning(f"Menu shown after {t_menu:.3f}s (target {STARTUP_TARGET}s)")
+    else:
+        log.debug(f"Menu shown after {t_menu:.3f}s")
 
     while True:        
-        choice = input("\n1.Search\n2.Add Videos\n3.Remove videos\n4.Exit\n : ")
+        choice = input("\n1.Search\n2.Add Videos\n3.Remove videos\n4.Exit\n5.Search Moments\n : ")
         try :
             choice = int(choice)
         except :
             continue
-        if choice == 1 :
+        if choice == 1 or choice == 5 :
+             warm_up_search()
              query = input("Enter search query : ")
              if query:
-                run_search(query)
+                run_search(query, moments=(choice == 5))
                 input("\nPress Enter to continue...")
                  
         elif choice == 2: